@@ -1,6 +1,12 @@
 from checkers.game.games_handler import GamesHandler
 from checkers.game.game import GameState
+from checkers.game.position_cache import PositionCache
+from checkers.capture import CaptureWriter
 from .player_handler import PlayerHandler
+from typing import List
+import asyncio
+import socket
+import threading
 import tornado.ioloop
 import tornado.websocket
 import tornado.httpserver
@@ -10,6 +16,9 @@ from tornado.options import options, define
 
 define('listen_port', group='webserver', default=8888, help='Listen port')
 define('unix_socket', group='webserver', default=None, help='Path to unix socket to bind')
+define('capture_file', group='webserver', default=None, help='Record inbound websocket traffic to this file for checkers.replay')
+define('loop_threads', group='webserver', default=1, help='Number of IOLoops accepting connections, each on its own thread')
+define('position_cache_size', group='game', default=PositionCache.DEFAULT_SIZE, help='Positions kept in the shared position cache, 0 disables it')
 
 
 application = tornado.web.Application([
@@ -17,15 +26,30 @@ application = tornado.web.Application([
 ])
 
 
+def serve_on_new_loop(sockets: List[socket.socket]) -> None:
+    # Every loop accepts from the same listening sockets, rooms stay on the loop that created them
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    http_server = tornado.httpserver.HTTPServer(application, xheaders=True)
+    http_server.add_sockets(sockets)
+    tornado.ioloop.IOLoop.current().start()
+
+
 if __name__ == '__main__':
     options.parse_command_line()
-    http_server = tornado.httpserver.HTTPServer(application, xheaders=True)
+    PositionCache().set_max_size(options.position_cache_size)
+    if options.capture_file:
+        CaptureWriter().start(options.capture_file)
     if options.unix_socket:
-        socket = tornado.netutil.bind_unix_socket(options.unix_socket)
-        http_server.add_socket(socket)
+        sockets = [tornado.netutil.bind_unix_socket(options.unix_socket)]
     else:
-        http_server.listen(options.listen_port, address='127.0.0.1')
+        sockets = tornado.netutil.bind_sockets(options.listen_port, address='127.0.0.1')
+    for _ in range(options.loop_threads - 1):
+        threading.Thread(target=serve_on_new_loop, args=(sockets, ), daemon=True).start()
+    http_server = tornado.httpserver.HTTPServer(application, xheaders=True)
+    http_server.add_sockets(sockets)
     print("Server ready")
     # Run every 30 minutes
     tornado.ioloop.PeriodicCallback(GamesHandler().check_and_remove_inactive, 30 * 60 * 1000).start()
+    if PositionCache().is_enabled():
+        tornado.ioloop.PeriodicCallback(lambda: print(PositionCache().stats_str()), 30 * 60 * 1000).start()
     tornado.ioloop.IOLoop.instance().start()
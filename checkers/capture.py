@@ -0,0 +1,203 @@
+from checkers.game.singleton import Singleton
+from checkers.game.game_piece import GamePieceColor
+from checkers.messages import MessageType
+from enum import Enum
+from typing import BinaryIO, Dict, Iterator, List, Union
+from uuid import UUID
+
+import atexit
+import hmac
+import itertools
+import os
+import struct
+import threading
+import time
+
+
+# File: magic + version (1 byte) + capture start as unix time (8 bytes)
+# Record: time since start in microseconds (8 bytes) + connection id (4 bytes)
+#         + event (1 byte) + payload length (4 bytes) + payload
+CAPTURE_MAGIC = b'CKCAP'
+CAPTURE_VERSION = 1
+HEADER = struct.Struct('!5sBd')
+RECORD = struct.Struct('!QIBI')
+
+
+class CaptureEvent(Enum):
+    OPEN = 1
+    MESSAGE = 2  # + inbound frame, player uuids pseudonymized
+    PLAYER = 3  # + pseudonymized uuid of the player the connection joined as
+    CLOSE = 4
+    COLOR = 5  # + piece color (1 byte) the server told the connection it plays, from START_GAME / CURRENT_STATE
+    TEXT_MESSAGE = 6  # + inbound text frame as UTF-8, pseudonymized like MESSAGE
+
+
+class CaptureRecord:
+    def __init__(self, time: float, connection_id: int, event: CaptureEvent, payload: bytes) -> None:
+        self.time = time
+        self.connection_id = connection_id
+        self.event = event
+        self.payload = payload
+
+
+class CaptureWriter(metaclass=Singleton):
+    # Records are appended to an in-memory buffer, a background thread writes it out
+    FLUSH_INTERVAL = 1.0
+    FLUSH_SIZE = 256 * 1024
+
+    def __init__(self) -> None:
+        self.file: BinaryIO = None
+        self.start_time: float = None
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+        # Held while writing so buffers taken by concurrent flushes stay in order
+        self.file_lock = threading.Lock()
+        self.flush_needed = threading.Event()
+        self.connection_ids = itertools.count(1)
+        # Per capture secret, the pseudonyms can't be traced back once the server is gone
+        self.pseudonym_key = os.urandom(32)
+
+    def is_enabled(self) -> bool:
+        return self.file is not None
+
+    def start(self, path: str) -> None:
+        self.file = open(path, 'wb')
+        self.start_time = time.monotonic()
+        self.file.write(HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, time.time()))
+        threading.Thread(target=self.flush_loop, daemon=True).start()
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        self.flush()
+        with self.file_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def new_connection_id(self) -> int:
+        # Handlers on different loop threads ask for ids concurrently
+        with self.lock:
+            return next(self.connection_ids)
+
+    def pseudonymize(self, uuid_str: str) -> str:
+        return hmac.new(self.pseudonym_key, UUID(hex=uuid_str).hex.encode('utf-8'), 'sha256').hexdigest()[:32]
+
+    def pseudonymize_message(self, message: bytes) -> bytes:
+        if message[:1] == bytes((MessageType.JOIN_EXISTING.value, )):
+            try:
+                return message[:1] + self.pseudonymize(message[1:].decode('utf-8')).encode('utf-8')
+            except ValueError:
+                # Not a uuid, so not anybody's id, keep it to reproduce the bad frame
+                pass
+        return message
+
+    def record(self, connection_id: int, event: CaptureEvent, payload: bytes = b'') -> None:
+        if self.file is None:
+            return
+        elapsed = int((time.monotonic() - self.start_time) * 1000000)
+        # Built in one piece so a bad payload can't leave a header without its payload behind
+        data = RECORD.pack(elapsed, connection_id, event.value, len(payload)) + payload
+        with self.lock:
+            self.buffer += data
+            if len(self.buffer) >= self.FLUSH_SIZE:
+                self.flush_needed.set()
+
+    def record_open(self, connection_id: int) -> None:
+        self.record(connection_id, CaptureEvent.OPEN)
+
+    def record_message(self, connection_id: int, message: Union[bytes, str]) -> None:
+        if self.file is not None:
+            if isinstance(message, str):
+                # Tornado hands text frames over as str
+                self.record(connection_id, CaptureEvent.TEXT_MESSAGE, self.pseudonymize_message(message.encode('utf-8')))
+            else:
+                self.record(connection_id, CaptureEvent.MESSAGE, self.pseudonymize_message(message))
+
+    def record_player(self, connection_id: int, uuid_str: str) -> None:
+        if self.file is not None:
+            self.record(connection_id, CaptureEvent.PLAYER, self.pseudonymize(uuid_str).encode('utf-8'))
+
+    def record_color(self, connection_id: int, color: GamePieceColor) -> None:
+        self.record(connection_id, CaptureEvent.COLOR, bytes((color.value, )))
+
+    def record_close(self, connection_id: int) -> None:
+        self.record(connection_id, CaptureEvent.CLOSE)
+
+    def flush_loop(self) -> None:
+        while self.file is not None:
+            self.flush_needed.wait(self.FLUSH_INTERVAL)
+            self.flush_needed.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        with self.file_lock:
+            with self.lock:
+                data = bytes(self.buffer)
+                self.buffer.clear()
+            if data and self.file is not None:
+                self.file.write(data)
+                self.file.flush()
+
+
+def read_capture(path: str) -> Iterator[CaptureRecord]:
+    with open(path, 'rb') as capture_file:
+        magic, version, _ = HEADER.unpack(capture_file.read(HEADER.size))
+        if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+            raise ValueError(f'{path} is not a version {CAPTURE_VERSION} capture file')
+        while True:
+            header = capture_file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                # A capture cut off mid-record (server killed) is still usable up to there
+                return
+            elapsed, connection_id, event, length = RECORD.unpack(header)
+            payload = capture_file.read(length)
+            if len(payload) < length:
+                return
+            yield CaptureRecord(elapsed / 1000000, connection_id, CaptureEvent(event), payload)
+
+
+def group_by_connection(records: Iterator[CaptureRecord]) -> Dict[int, List[CaptureRecord]]:
+    connections: Dict[int, List[CaptureRecord]] = {}
+    for record in records:
+        connections.setdefault(record.connection_id, []).append(record)
+    return connections
+
+
+def check_round_trip() -> None:
+    # Writes a capture with every kind of record and reads it back
+    import tempfile
+    uuid_str = UUID(int=1).hex
+    join = bytes((MessageType.JOIN_EXISTING.value, )) + uuid_str.encode('utf-8')
+    long_frame = bytes((MessageType.MOVE.value, )) + b'x' * 70000
+    text_frame = chr(MessageType.JOIN_EXISTING.value) + uuid_str
+    writer = CaptureWriter()
+    pseudonym = None
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'capture.bin')
+        writer.start(path)
+        pseudonym = writer.pseudonymize(uuid_str).encode('utf-8')
+        writer.record_open(1)
+        writer.record_message(1, text_frame)
+        writer.record_message(1, join)
+        writer.record_player(1, uuid_str)
+        writer.record_color(1, GamePieceColor.DARK)
+        writer.record_message(1, long_frame)
+        writer.record_close(1)
+        writer.close()
+        records = [(record.connection_id, record.event, record.payload) for record in read_capture(path)]
+    expected = [
+        (1, CaptureEvent.OPEN, b''),
+        (1, CaptureEvent.TEXT_MESSAGE, join[:1] + pseudonym),
+        (1, CaptureEvent.MESSAGE, join[:1] + pseudonym),
+        (1, CaptureEvent.PLAYER, pseudonym),
+        (1, CaptureEvent.COLOR, bytes((GamePieceColor.DARK.value, ))),
+        (1, CaptureEvent.MESSAGE, long_frame),
+        (1, CaptureEvent.CLOSE, b''),
+    ]
+    if records != expected:
+        raise SystemExit(f'Capture round trip failed, read back {[(record[1].name, len(record[2])) for record in records]}')
+    print(f'Capture round trip OK, {len(records)} records')
+
+
+if __name__ == '__main__':
+    check_round_trip()
@@ -1,5 +1,6 @@
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 from checkers.game.game_piece import GamePiece, GamePieceColor, GamePieceType
+from checkers.game.position_cache import PositionCache, PositionInfo
 from enum import Enum
 
 
@@ -42,6 +43,8 @@ class MoveResult:
 class Game:
     board_width = 4
     board_height = 8
+    # Set to False to silence the board dump after every move (e.g. in the simulator)
+    print_board = True
 
     def __init__(self) -> None:
         self.game_state: GameState = GameState.NOT_STARTED
@@ -49,10 +52,14 @@ class Game:
         self.fields: List[GamePiece] = [None for _ in range(
             self.board_height*self.board_width+1)]  # Plus one because staring from 1
         self.continue_capturing_field_no = None
+        # Cache entry of the current position, reset whenever the position changes.
+        # Looking it up once per position keeps repeated queries by this game out of the cache stats.
+        self.position_info: PositionInfo = None
 
     def start_game(self) -> None:
         self.init_pieces()
         self.game_state = GameState.LIGHT_TURN
+        self.position_info = None
 
     def row_col2field_no(self, row: int, col: int) -> int:
         return row * self.board_width + col + 1
@@ -83,6 +90,8 @@ class Game:
         self.debug_print_board()
 
     def debug_print_board(self) -> None:
+        if not self.print_board:
+            return
         board_repr = []
         for row in range(self.board_height-1, -1, -1):
             if row % 2 != 0:
@@ -192,6 +201,7 @@ class Game:
             if self.can_capture_any(from_field):
                 return MoveResult(MoveError.MUST_CAPTURE)
         # Move the piece
+        self.position_info = None
         self.fields[to_field] = piece
         piece.field_no = to_field
         self.fields[from_field] = None
@@ -316,7 +326,96 @@ class Game:
                     return True
         return self.can_capture_any(from_field)
 
+    def get_neighbour_fields(self, from_field: int, distance: int) -> List[Tuple[int, int]]:
+        # Returns (to_field, through_field) pairs for every on-board diagonal target
+        # the piece on from_field may move to, respecting its color and type.
+        # through_field is None for single-field moves.
+        piece = self.fields[from_field]
+        from_row, from_col = self.field_no2row_col(from_field)
+        row_offsets = []
+        if piece.get_color() == GamePieceColor.DARK or piece.get_type() == GamePieceType.KING:
+            row_offsets.append(1)
+        if piece.get_color() == GamePieceColor.LIGHT or piece.get_type() == GamePieceType.KING:
+            row_offsets.append(-1)
+        # Column of the diagonal neighbour one row away, depends on row parity
+        near_cols = (from_col+1, from_col) if from_row % 2 == 0 else (from_col, from_col-1)
+        neighbours = []
+        for row_offset in row_offsets:
+            for near_col, far_col in zip(near_cols, (from_col+1, from_col-1)):
+                if distance == 1:
+                    row, col, through_field = from_row+row_offset, near_col, None
+                else:
+                    row, col = from_row+2*row_offset, far_col
+                    through_field = self.row_col2field_no(from_row+row_offset, near_col)
+                if row >= 0 and row < self.board_height and col >= 0 and col < self.board_width:
+                    neighbours.append((self.row_col2field_no(row, col), through_field))
+        return neighbours
+
+    def get_legal_moves(self) -> Dict[Tuple[int, int], Optional[int]]:
+        # Maps (from_field, to_field) pairs accepted by move_piece in the current state
+        # to the field of the piece the move captures (None if it doesn't capture)
+        if self.game_state == GameState.LIGHT_TURN:
+            color = GamePieceColor.LIGHT
+        elif self.game_state == GameState.DARK_TURN:
+            color = GamePieceColor.DARK
+        else:
+            return {}
+        if self.continue_capturing_field_no is not None:
+            from_fields = [self.continue_capturing_field_no]
+        else:
+            from_fields = [piece.field_no for piece in self.fields
+                           if piece is not None and piece.get_color() == color]
+        moves = {}
+        for from_field in from_fields:
+            if self.can_capture_any(from_field):
+                for to_field, through_field in self.get_neighbour_fields(from_field, 2):
+                    if self.fields[to_field] is None and self.get_piece_color(through_field) not in \
+                            (color, GamePieceColor.NOCOLOR):
+                        moves[(from_field, to_field)] = through_field
+            else:
+                for to_field, _ in self.get_neighbour_fields(from_field, 1):
+                    if self.fields[to_field] is None:
+                        moves[(from_field, to_field)] = None
+        return moves
+
+    def encode_position(self) -> bytes:
+        # game state (1 byte) + continue capturing field (1 byte) + pieces packed as in messages.encode_piece
+        # Identity checks instead of Enum.value, this runs for every position
+        dark = GamePieceColor.DARK
+        king = GamePieceType.KING
+        packed = [self.game_state.value, self.continue_capturing_field_no or 0]
+        for piece in self.fields:
+            if piece is not None:
+                packed.append(piece.field_no | (64 if piece.color is dark else 0) | (128 if piece.type is king else 0))
+        return bytes(packed)
+
+    def get_position_info(self) -> PositionInfo:
+        if self.position_info is None:
+            if PositionCache().is_enabled():
+                self.position_info = PositionCache().get(self.encode_position())
+            else:
+                self.position_info = PositionInfo()
+        return self.position_info
+
+    def get_position_terminal_state(self) -> Optional[GameState]:
+        info = self.get_position_info()
+        if not info.terminal_state_known:
+            info.terminal_state = self.get_victory_state()
+            info.terminal_state_known = True
+        return info.terminal_state
+
     def check_victory(self) -> bool:
+        terminal_state = self.get_position_terminal_state()
+        if terminal_state is None:
+            return False
+        self.game_state = terminal_state
+        # The game can end in the middle of a capture chain (the opponent lost its
+        # last movable piece), there is nothing left to continue
+        self.continue_capturing_field_no = None
+        self.position_info = None
+        return True
+
+    def get_victory_state(self) -> Optional[GameState]:
         light_pieces_count = 0
         dark_pieces_count = 0
         light_pieces_that_can_move = 0
@@ -332,12 +431,9 @@ class Game:
                     if self.can_piece_make_any_move(piece.field_no):
                         dark_pieces_that_can_move += 1
         if light_pieces_that_can_move == 0 and dark_pieces_that_can_move == 0:
-            self.game_state = GameState.TIE
-            return True
+            return GameState.TIE
         if light_pieces_count == 0 or light_pieces_that_can_move == 0:
-            self.game_state = GameState.DARK_WON
-            return True
+            return GameState.DARK_WON
         if dark_pieces_count == 0 or dark_pieces_that_can_move == 0:
-            self.game_state = GameState.LIGHT_WON
-            return True
-        return False
+            return GameState.LIGHT_WON
+        return None
@@ -1,14 +1,23 @@
 from . import player, game
 
+from uuid import UUID, uuid4
 import random
 
 
 class GameRoom:
-    def __init__(self) -> None:
+    def __init__(self, io_loop: 'tornado.ioloop.IOLoop' = None) -> None:
         self.players: list['player.Player'] = [None, None]
         self.game: 'game.Game' = None
         self.in_game = False
+        # Set once a game played in the room is over, rooms are never reused
+        self.finished = False
         self.light_player_id = random.randint(0, 1)
+        self.uuid: UUID = uuid4()
+        # Loop the room's game is played on, None if not run by a server
+        self.io_loop = io_loop
+
+    def get_uuid_str(self) -> str:
+        return str(self.uuid.hex)
 
     def is_full(self) -> bool:
         return self.players[0] is not None and self.players[1] is not None
@@ -32,3 +41,4 @@ class GameRoom:
     def end_game(self) -> None:
         self.game = None
         self.in_game = False
+        self.finished = True
@@ -1,39 +1,73 @@
-from typing import List, Tuple
+from typing import Callable, Dict, List, Tuple
 from checkers.messages import MessageType
 from .game_room import GameRoom
 from .player import Player
-from .game import Game, GameError, MoveResult
+from .game import Game, MoveError, MoveResult
+from .singleton import Singleton
 
+from tornado.ioloop import IOLoop
+import threading
 import time
 
 
-class Singleton(type):
-    _instances = {}
-
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(
-                Singleton, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
+class GamesHandlerShard:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.rooms: Dict[str, GameRoom] = {}
+        self.players: Dict[str, Player] = {}
 
 
 class GamesHandler(metaclass=Singleton):
+    # Rooms and players are spread over shards by uuid, each shard has its own lock.
+    # Every GameRoom belongs to the IOLoop it was created on, anything touching
+    # its game is handed over to that loop.
     INACTIVITY_TIMEOUT = 15 * 60
+    SHARD_COUNT = 16
 
     def __init__(self) -> None:
-        self.rooms: List[GameRoom] = []
-        self.players: List[Player] = {}
+        self.shards: List[GamesHandlerShard] = [GamesHandlerShard() for _ in range(self.SHARD_COUNT)]
+        # Guards waiting_rooms and creating players, so each player is matched exactly once.
+        # Acquired before any shard lock, never while holding one.
+        self.matching_lock = threading.RLock()
+        self.waiting_rooms: List[GameRoom] = []
+
+    def get_shard(self, uuid_str: str) -> GamesHandlerShard:
+        return self.shards[int(uuid_str, 16) % len(self.shards)]
+
+    def count_players(self) -> int:
+        return sum(len(shard.players) for shard in self.shards)
+
+    def count_rooms(self) -> int:
+        return sum(len(shard.rooms) for shard in self.shards)
+
+    def get_rooms(self) -> List[GameRoom]:
+        rooms = []
+        for shard in self.shards:
+            with shard.lock:
+                rooms.extend(shard.rooms.values())
+        return rooms
+
+    def hand_over(self, room: GameRoom, func: Callable, *args) -> bool:
+        # Returns True if func was scheduled on the loop owning the room instead of running here
+        if room.io_loop is None or room.io_loop is IOLoop.current(instance=False):
+            return False
+        room.io_loop.add_callback(func, *args)
+        return True
 
     def find_empty_room(self) -> GameRoom:
-        for room in self.rooms:
+        # Caller must hold matching_lock
+        for room in self.waiting_rooms:
             if not room.is_full():
                 return room
-        room = GameRoom()
-        self.rooms.append(room)
+        room = GameRoom(IOLoop.current(instance=False))
+        self.waiting_rooms.append(room)
+        shard = self.get_shard(room.get_uuid_str())
+        with shard.lock:
+            shard.rooms[room.get_uuid_str()] = room
         return room
 
     def check_and_remove_inactive(self) -> None:
-        for room in self.rooms:
+        for room in self.get_rooms():
             is_any_player_active: bool = False
             for player in room.players:
                 if player is not None:
@@ -43,40 +77,72 @@ class GamesHandler(metaclass=Singleton):
                         continue
             if not is_any_player_active:
                 self.remove_room(room)
-                print(f"Removing a room due to inactivity, {len(self.players.keys())} players and {len(self.rooms)} rooms left")
+                print(f"Removing a room due to inactivity, {self.count_players()} players and {self.count_rooms()} rooms left")
 
     def remove_room(self, room: GameRoom) -> None:
-        for player in room.players:
-            if player is not None:
-                try:
-                    del self.players[player.get_uuid_str()]
-                except KeyError:
-                    print(f"Couldn't find player with uuid {room.players[0]} while removing")
-        self.rooms.remove(room)
+        with self.matching_lock:
+            if room in self.waiting_rooms:
+                self.waiting_rooms.remove(room)
+            for player in room.players:
+                if player is not None:
+                    shard = self.get_shard(player.get_uuid_str())
+                    with shard.lock:
+                        # The uuid may have joined again with a new Player since this room was removed
+                        if shard.players.get(player.get_uuid_str()) is player:
+                            del shard.players[player.get_uuid_str()]
+                        else:
+                            print(f"Couldn't find player with uuid {player.get_uuid_str()} while removing")
+            shard = self.get_shard(room.get_uuid_str())
+            with shard.lock:
+                shard.rooms.pop(room.get_uuid_str(), None)
+
+    def remove_if_not_in_game(self, player: Player) -> None:
+        room: GameRoom = player.room
+        if self.hand_over(room, self.remove_if_not_in_game, player):
+            return
+        with self.matching_lock:
+            # A full room that isn't in a game yet was matched on another loop and its start
+            # is already queued here, only rooms still waiting or already finished can go
+            if room in self.waiting_rooms or room.finished:
+                self.remove_room(room)
+                print("Player has left, he/she wasn't in a game so removing his/her room")
 
     def get_player(self, uuid_str: str) -> Player:
-        return self.players.get(uuid_str)
+        shard = self.get_shard(uuid_str)
+        with shard.lock:
+            return shard.players.get(uuid_str)
 
     def initialize_player(self, uuid_str: str = None) -> Player:
+        # Caller must hold matching_lock
         player = Player(uuid_str)
         room = self.find_empty_room()
         in_room_id = room.add_player(player)
         player.set_game_room(room, in_room_id)
-        self.players[player.get_uuid_str()] = player
-        print(f'{len(self.players.keys())} players, {len(self.rooms)} rooms')
+        if room.is_full():
+            self.waiting_rooms.remove(room)
+        shard = self.get_shard(player.get_uuid_str())
+        with shard.lock:
+            shard.players[player.get_uuid_str()] = player
+        print(f'{self.count_players()} players, {self.count_rooms()} rooms')
         return player
 
     def add_player(self, uuid_str: str = None) -> Tuple[Player, bool]:
         # Returns True if new Player object was created
-        if uuid_str is None:
-            return self.initialize_player(None), True
-        player = self.players.get(uuid_str)
-        if player is None:
+        if uuid_str is not None:
+            player = self.get_player(uuid_str)
+            if player is not None:
+                return player, False
+        with self.matching_lock:
+            if uuid_str is not None:
+                # Another loop could have added the same uuid in the meantime
+                player = self.get_player(uuid_str)
+                if player is not None:
+                    return player, False
             return self.initialize_player(uuid_str), True
-        else:
-            return player, False
 
     def check_and_start_game(self, room: GameRoom) -> None:
+        if self.hand_over(room, self.check_and_start_game, room):
+            return
         if room.can_game_start():
             room.start_game()
             room.players[0].send_msg(
@@ -86,16 +152,20 @@ class GamesHandler(metaclass=Singleton):
             print("Game started")
 
     def send_state(self, player: Player) -> None:
+        if self.hand_over(player.room, self.send_state, player):
+            return
         if player.room.in_game:
             pieces = player.room.game.filter_pieces()
             player.send_msg(MessageType.CURRENT_STATE, 
                 {'piece_color': player.piece_color, 'game_state': player.room.game.game_state, 'pieces': pieces})
 
     def move_piece(self, player: Player, from_field: int, to_field: int) -> None:
+        if self.hand_over(player.room, self.move_piece, player, from_field, to_field):
+            return
         game: Game = player.room.game
         if game.get_piece_color(from_field) == player.piece_color:
             result: MoveResult = game.move_piece(from_field, to_field)
-            if result.move_error != GameError.NO_ERROR:
+            if result.move_error != MoveError.NO_ERROR:
                 player.send_msg(MessageType.WRONG_MOVE, 
                     {'from_field': from_field, 'error': result.move_error})
             else:
@@ -106,10 +176,12 @@ class GamesHandler(metaclass=Singleton):
                                          'end_turn': result.end_turn, 'promote': result.promote, 'captured_field': result.captured_piece_field})
         else:
             player.send_msg(MessageType.WRONG_MOVE, 
-                {'from_field': from_field, 'error': GameError.NOT_YOUR_PIECE})
+                {'from_field': from_field, 'error': MoveError.NOT_YOUR_PIECE})
         self.check_victory(player)
 
     def check_victory(self, player: Player) -> None:
+        if self.hand_over(player.room, self.check_victory, player):
+            return
         game: Game = player.room.game
         if game.check_victory():
             room: GameRoom = player.room
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
+import threading
+from .singleton import Singleton
+
+if TYPE_CHECKING:
+    from .game import GameState
+
+
+class PositionInfo:
+    # Filled in lazily by Game when somebody asks for it
+    def __init__(self) -> None:
+        # State check_victory ends the game with, None if the game goes on
+        self.terminal_state: Optional['GameState'] = None
+        self.terminal_state_known = False
+
+
+class PositionCache(metaclass=Singleton):
+    # Shared by every game in the process. Off by default, games leave the openings within
+    # a few moves and a cold cache costs more than it saves, so it only pays off where the
+    # same positions come back (replaying or simulating many similar games).
+    DEFAULT_SIZE = 0
+
+    def __init__(self) -> None:
+        self.positions: 'OrderedDict[bytes, PositionInfo]' = OrderedDict()
+        self.max_size = self.DEFAULT_SIZE
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Games on different IOLoop threads share the cache
+        self.lock = threading.Lock()
+
+    def is_enabled(self) -> bool:
+        return self.max_size > 0
+
+    def set_max_size(self, max_size: int) -> None:
+        with self.lock:
+            self.max_size = max_size
+            self.evict()
+
+    def get(self, key: bytes) -> PositionInfo:
+        # Returns the shared entry for the position, creating an empty one if it's new
+        with self.lock:
+            info = self.positions.get(key)
+            if info is not None:
+                self.hits += 1
+                self.positions.move_to_end(key)
+                return info
+            self.misses += 1
+            info = PositionInfo()
+            if self.max_size > 0:
+                self.positions[key] = info
+                self.evict()
+            return info
+
+    def evict(self) -> None:
+        # Caller must hold lock
+        while len(self.positions) > self.max_size:
+            self.positions.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.positions.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'size': len(self.positions), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def stats_str(self) -> str:
+        stats = self.get_stats()
+        return f"Position cache: {stats['size']}/{stats['max_size']} positions, {stats['hits']} hits, " \
+            f"{stats['misses']} misses ({100 * stats['hit_rate']:.1f}% hit rate), {stats['evictions']} evictions"
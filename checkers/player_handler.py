@@ -1,8 +1,10 @@
 from checkers.messages import MessageType, encode_piece_list
-from typing import List, Optional
+from checkers.capture import CaptureWriter
+from typing import List, Optional, Union
 from checkers.game.games_handler import GamesHandler
 from checkers.game import player
 
+import tornado.ioloop
 import tornado.websocket
 import struct
 
@@ -11,6 +13,9 @@ class PlayerHandler(tornado.websocket.WebSocketHandler):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.player: 'player.Player' = None
+        # The connection may only be written to from the loop serving it
+        self.io_loop = tornado.ioloop.IOLoop.current()
+        self.connection_id = CaptureWriter().new_connection_id()
         self.msg_send_lookup = {
             MessageType.WELCOME: self.msg_encode_welcome,
             MessageType.WELCOME_NEW: self.msg_encode_welcome_new,
@@ -27,6 +32,7 @@ class PlayerHandler(tornado.websocket.WebSocketHandler):
 
     def open(self) -> None:
         print("New Connection")
+        CaptureWriter().record_open(self.connection_id)
 
     def select_subprotocol(self, subprotocols: List[str]) -> Optional[str]:
         if "checkers_game" in subprotocols:
@@ -57,12 +63,21 @@ class PlayerHandler(tornado.websocket.WebSocketHandler):
 
     def msg_send(self, msg_type: MessageType, data: dict = None) -> None:
         print(f'Message {msg_type.name} sent to {self.player.get_uuid_str()}')
-        self.write_message(self.msg_send_lookup[msg_type](data), binary=True)
+        # Encode right away, data may refer to a game owned by another loop
+        message = self.msg_send_lookup[msg_type](data)
+        if msg_type in (MessageType.START_GAME, MessageType.CURRENT_STATE):
+            # Colors are random, replay needs them to tell swapped rooms from real errors
+            CaptureWriter().record_color(self.connection_id, data['piece_color'])
+        if self.io_loop is tornado.ioloop.IOLoop.current(instance=False):
+            self.write_message(message, binary=True)
+        else:
+            self.io_loop.add_callback(self.write_message, message, binary=True)
 
     def msg_recv_join_new(self) -> None:
         self.player, _ = GamesHandler().add_player(None)
         self.player.set_send_msg_func(self.msg_send)
         self.player.mark_connected()
+        CaptureWriter().record_player(self.connection_id, self.player.get_uuid_str())
         print("Received JOIN_NEW")
         self.msg_send(MessageType.WELCOME_NEW,
             {'uuid_str': self.player.get_uuid_str()})
@@ -73,6 +88,7 @@ class PlayerHandler(tornado.websocket.WebSocketHandler):
         self.player, is_new = GamesHandler().add_player(uuid_str)
         self.player.set_send_msg_func(self.msg_send)
         self.player.mark_connected()
+        CaptureWriter().record_player(self.connection_id, self.player.get_uuid_str())
         print(f"Received JOIN_EXISTING from {uuid_str}")
         if is_new:
             self.msg_send(MessageType.WELCOME)
@@ -85,7 +101,8 @@ class PlayerHandler(tornado.websocket.WebSocketHandler):
         print(f"Received MOVE from {self.player.get_uuid_str()} from {from_field} to {to_field}")
         GamesHandler().move_piece(self.player, from_field, to_field)
 
-    def on_message(self, message: bytes) -> None:
+    def on_message(self, message: Union[bytes, str]) -> None:
+        CaptureWriter().record_message(self.connection_id, message)
         msg_type = MessageType(struct.unpack('!B', bytes((message[0], )))[0])
         if msg_type == MessageType.JOIN_NEW:
             self.msg_recv_join_new()
@@ -98,8 +115,7 @@ class PlayerHandler(tornado.websocket.WebSocketHandler):
 
     def on_close(self) -> None:
         print("Connection closed")
+        CaptureWriter().record_close(self.connection_id)
         if self.player is not None:
             self.player.mark_disconnected()
-            if not self.player.room.in_game:
-                GamesHandler().remove_room(self.player.room)
-                print("Player has left, he/she wasn't in a game so removing his/her room")
+            GamesHandler().remove_if_not_in_game(self.player)
@@ -0,0 +1,233 @@
+from checkers.capture import CaptureEvent, CaptureRecord, group_by_connection, read_capture
+from checkers.game.game import MoveError
+from checkers.messages import MessageType
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+from tornado.options import options, define
+from tornado.websocket import WebSocketClientConnection, websocket_connect
+
+import asyncio
+import time
+
+
+define('capture_file', group='replay', default=None, help='Capture recorded with the server\'s --capture_file')
+define('url', group='replay', default='ws://127.0.0.1:8888/ws', help='Websocket URL of the server to replay against')
+define('speed', group='replay', default=1.0, help='Replay speed, 2 plays the capture twice as fast')
+define('reply_timeout', group='replay', default=5.0, help='Seconds to wait for outstanding replies before closing')
+
+
+# Server messages that answer each client message
+REPLIES = {
+    MessageType.JOIN_NEW: (MessageType.WELCOME_NEW, ),
+    MessageType.JOIN_EXISTING: (MessageType.WELCOME, MessageType.CURRENT_STATE),
+    MessageType.MOVE: (MessageType.MOVE_OK, MessageType.WRONG_MOVE),
+}
+
+
+# Capture events sent to the server, the others only describe the capture
+REPLAYED_EVENTS = (CaptureEvent.OPEN, CaptureEvent.MESSAGE, CaptureEvent.TEXT_MESSAGE, CaptureEvent.CLOSE)
+
+
+class PendingRequest:
+    def __init__(self, msg_type: MessageType, payload: bytes) -> None:
+        self.msg_type = msg_type
+        self.payload = payload
+        self.sent_time = time.perf_counter()
+
+    def is_answered_by(self, reply_type: MessageType, reply: bytes) -> bool:
+        if reply_type not in REPLIES.get(self.msg_type, ()):
+            return False
+        if self.msg_type == MessageType.MOVE:
+            # MOVE_OK echoes from and to (the opponent's moves arrive too), WRONG_MOVE echoes from
+            return reply[1:1 + (2 if reply_type == MessageType.MOVE_OK else 1)] == \
+                self.payload[1:1 + (2 if reply_type == MessageType.MOVE_OK else 1)]
+        return True
+
+
+class ReplayStats:
+    def __init__(self) -> None:
+        self.sent = Counter()
+        self.latencies: Dict[MessageType, List[float]] = defaultdict(list)
+        # msg_type (None for connection level problems) -> error -> count
+        self.errors: Dict[Optional[MessageType], Counter] = defaultdict(Counter)
+        # Connections given the other color than in the capture, their moves can't be
+        # replayed faithfully so their errors are kept apart
+        self.swapped_connections = 0
+        self.swapped_errors = Counter()
+        # Longest the replay ran behind the capture's timing, in seconds
+        self.max_lag = 0.0
+
+    def add_error(self, msg_type: Optional[MessageType], error: str, swapped: bool = False) -> None:
+        if swapped:
+            self.swapped_errors[error] += 1
+        else:
+            self.errors[msg_type][error] += 1
+
+    def report(self, elapsed: float, capture_duration: float) -> None:
+        print(f'Replayed {capture_duration:.1f}s of capture in {elapsed:.1f}s, {sum(self.sent.values())} frames sent, '
+              f'at most {1000 * self.max_lag:.1f}ms behind the capture')
+        print(f'{"message":<14}{"sent":>8}{"replies":>9}{"p50 ms":>9}{"p90 ms":>9}{"p99 ms":>9}{"max ms":>9}')
+        for msg_type in MessageType:
+            if msg_type not in self.sent:
+                continue
+            latencies = sorted(self.latencies[msg_type])
+            columns = [percentile(latencies, p) for p in (0.5, 0.9, 0.99)] + [latencies[-1] if latencies else None]
+            print(f'{msg_type.name:<14}{self.sent[msg_type]:>8}{len(latencies):>9}' +
+                  ''.join(f'{1000 * column:>9.2f}' if column is not None else f'{"-":>9}' for column in columns))
+        for msg_type, errors in self.errors.items():
+            for error, count in errors.most_common():
+                print(f'  {msg_type.name if msg_type else "CONNECTION"}: {error} x{count}')
+        if self.swapped_connections:
+            print(f'{self.swapped_connections} connections played the other color than in the capture, '
+                  f'their moves with it were not checked')
+        if self.swapped_errors:
+            print('Errors while playing the other color, not counted:')
+            for error, count in self.swapped_errors.most_common():
+                print(f'  MOVE: {error} x{count}')
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+class ReplayConnection:
+    def __init__(self, records: List[CaptureRecord], stats: ReplayStats, uuid_map: Dict[str, str]) -> None:
+        self.records = records
+        self.stats = stats
+        # Capture pseudonym -> uuid the replay server gave that player
+        self.uuid_map = uuid_map
+        self.pseudonyms = [record.payload.decode('utf-8') for record in records
+                           if record.event == CaptureEvent.PLAYER]
+        # Colors the server told this connection in the capture, in order
+        self.colors = [record.payload[0] for record in records if record.event == CaptureEvent.COLOR]
+        # Playing the other color than in the capture right now, and at any point
+        self.swapped = False
+        self.ever_swapped = False
+        self.pending: List[PendingRequest] = []
+        self.ws: WebSocketClientConnection = None
+        self.reader: asyncio.Future = None
+
+    def rewrite(self, message: bytes) -> bytes:
+        if message[:1] == bytes((MessageType.JOIN_EXISTING.value, )):
+            pseudonym = message[1:].decode('utf-8', errors='replace')
+            if pseudonym in self.uuid_map:
+                return message[:1] + self.uuid_map[pseudonym].encode('utf-8')
+        return message
+
+    def handle_reply(self, reply: bytes) -> None:
+        try:
+            reply_type = MessageType(reply[0])
+        except (ValueError, IndexError):
+            self.stats.add_error(None, 'unknown reply')
+            return
+        if reply_type == MessageType.WELCOME_NEW and self.pseudonyms:
+            self.uuid_map[self.pseudonyms.pop(0)] = reply[1:].decode('utf-8')
+        if reply_type in (MessageType.START_GAME, MessageType.CURRENT_STATE) and self.colors:
+            # Piece color is the first byte after the type in both. Every one of them can
+            # swap or restore the colors, e.g. CURRENT_STATE after joining a new room.
+            swapped = reply[1] != self.colors.pop(0)
+            if swapped and not self.ever_swapped:
+                self.ever_swapped = True
+                self.stats.swapped_connections += 1
+            self.swapped = swapped
+        for request in self.pending:
+            if request.is_answered_by(reply_type, reply):
+                self.pending.remove(request)
+                self.stats.latencies[request.msg_type].append(time.perf_counter() - request.sent_time)
+                if reply_type == MessageType.WRONG_MOVE:
+                    self.stats.add_error(request.msg_type, f'WRONG_MOVE {MoveError(reply[2]).name}', self.swapped)
+                return
+
+    async def read_replies(self) -> None:
+        while True:
+            reply = await self.ws.read_message()
+            if reply is None:
+                return
+            self.handle_reply(reply)
+
+    async def open(self) -> None:
+        try:
+            self.ws = await websocket_connect(options.url, subprotocols=['checkers_game'])
+            # Frames go out when the capture sent them, not batched by Nagle
+            self.ws.protocol.set_nodelay(True)
+            self.reader = asyncio.ensure_future(self.read_replies())
+        except Exception as e:
+            self.stats.add_error(None, type(e).__name__)
+
+    async def send(self, payload: bytes, binary: bool = True) -> None:
+        if self.ws is None:
+            return
+        message = self.rewrite(payload)
+        try:
+            msg_type = MessageType(message[0])
+            self.stats.sent[msg_type] += 1
+            if msg_type in REPLIES:
+                self.pending.append(PendingRequest(msg_type, message))
+        except (ValueError, IndexError):
+            self.stats.add_error(None, 'sent invalid message type')
+        try:
+            await self.ws.write_message(message if binary else message.decode('utf-8', errors='replace'), binary=binary)
+        except Exception as e:
+            self.stats.add_error(None, type(e).__name__)
+
+    async def close(self, reply_timeout: float) -> None:
+        # Runs on its own so waiting for the last replies doesn't hold up the other connections
+        deadline = time.perf_counter() + reply_timeout
+        while self.pending and self.reader is not None and not self.reader.done() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        for request in self.pending:
+            self.stats.add_error(request.msg_type, 'no reply', self.swapped and request.msg_type == MessageType.MOVE)
+        self.pending.clear()
+        if self.ws is not None:
+            self.ws.close()
+        if self.reader is not None:
+            self.reader.cancel()
+
+
+async def replay(connections: Dict[int, List[CaptureRecord]], speed: float, reply_timeout: float) -> ReplayStats:
+    # Records of all connections are replayed in one timeline, so a connect that takes longer
+    # than the gap to the next record delays everything after it instead of reordering it
+    stats = ReplayStats()
+    uuid_map: Dict[str, str] = {}
+    replay_connections = {connection_id: ReplayConnection(records, stats, uuid_map)
+                          for connection_id, records in connections.items()}
+    records = sorted((record for records in connections.values() for record in records
+                      if record.event in REPLAYED_EVENTS), key=lambda record: record.time)
+    first_record_time = records[0].time if records else 0.0
+    closing = []
+    start_time = time.perf_counter()
+    for record in records:
+        delay = start_time + (record.time - first_record_time) / speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            stats.max_lag = max(stats.max_lag, -delay)
+        connection = replay_connections.get(record.connection_id)
+        if connection is None:
+            # Already closed, or never opened within the capture
+            continue
+        if record.event == CaptureEvent.OPEN:
+            await connection.open()
+        elif record.event in (CaptureEvent.MESSAGE, CaptureEvent.TEXT_MESSAGE):
+            await connection.send(record.payload, binary=record.event == CaptureEvent.MESSAGE)
+        elif record.event == CaptureEvent.CLOSE:
+            closing.append(asyncio.ensure_future(connection.close(reply_timeout)))
+            del replay_connections[record.connection_id]
+    # Connections still open when the capture ended
+    closing.extend(asyncio.ensure_future(connection.close(reply_timeout)) for connection in replay_connections.values())
+    await asyncio.gather(*closing)
+    return stats
+
+
+if __name__ == '__main__':
+    options.parse_command_line()
+    if not options.capture_file:
+        raise SystemExit('--capture_file is required')
+    connections = group_by_connection(read_capture(options.capture_file))
+    capture_duration = max((records[-1].time for records in connections.values()), default=0.0) - \
+        min((records[0].time for records in connections.values()), default=0.0)
+    start_time = time.perf_counter()
+    stats = asyncio.get_event_loop().run_until_complete(replay(connections, options.speed, options.reply_timeout))
+    stats.report(time.perf_counter() - start_time, capture_duration)
@@ -0,0 +1,177 @@
+from checkers.game.game import Game, GameState, MoveError, MoveResult
+from checkers.game.game_piece import GamePieceColor
+from checkers.game.game_room import GameRoom
+from checkers.game.position_cache import PositionCache
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Tuple
+from tornado.options import options, define
+
+import random
+import time
+
+
+define('games', group='simulator', default=10000, help='Number of games to simulate')
+define('workers', group='simulator', default=None, type=int, help='Number of worker processes (default: CPU count)')
+define('chunk_size', group='simulator', default=1000, help='Games per worker task')
+define('seed', group='simulator', default=0, help='Base seed, chunk n uses seed + n')
+define('light_policy', group='simulator', default='random', help='Move policy of the light side (random, greedy)')
+define('dark_policy', group='simulator', default='random', help='Move policy of the dark side (random, greedy)')
+define('max_moves', group='simulator', default=500, help='Moves after which a game is abandoned as unfinished')
+define('position_cache_size', group='simulator', default=PositionCache.DEFAULT_SIZE, help='Positions kept in each worker\'s cache, 0 disables it')
+
+
+TERMINAL_STATES = (GameState.LIGHT_WON, GameState.DARK_WON, GameState.TIE)
+MOVE_LIMIT = 'MOVE_LIMIT'
+
+
+def policy_random(game: Game, moves: List[Tuple[int, int]], rng: random.Random) -> Tuple[int, int]:
+    return rng.choice(moves)
+
+
+def policy_greedy(game: Game, moves: List[Tuple[int, int]], rng: random.Random) -> Tuple[int, int]:
+    # Prefer captures, then moves that promote, then anything
+    captures = [move for move in moves if abs(game.field_no2row_col(move[0])[0] - game.field_no2row_col(move[1])[0]) == 2]
+    if captures:
+        return rng.choice(captures)
+    last_row = {GamePieceColor.LIGHT: 0, GamePieceColor.DARK: game.board_height-1}
+    promotions = [move for move in moves
+                  if game.field_no2row_col(move[1])[0] == last_row[game.get_piece_color(move[0])]]
+    if promotions:
+        return rng.choice(promotions)
+    return rng.choice(moves)
+
+
+POLICIES: Dict[str, Callable] = {
+    'random': policy_random,
+    'greedy': policy_greedy,
+}
+
+
+def check_invariants(game: Game, captured: Dict[GamePieceColor, int], result: str) -> List[str]:
+    violations = []
+    pieces = game.filter_pieces()
+    for color in (GamePieceColor.LIGHT, GamePieceColor.DARK):
+        count = len([piece for piece in pieces if piece.get_color() == color])
+        if count != 12 - captured[color]:
+            violations.append(f'{color.name} has {count} pieces, expected {12 - captured[color]}')
+    for field_no, piece in enumerate(game.fields):
+        if piece is not None and piece.field_no != field_no:
+            violations.append(f'Piece {piece} stored on field {field_no}')
+    if game.continue_capturing_field_no is not None:
+        violations.append(f'Stray continue_capturing_field_no {game.continue_capturing_field_no}')
+    if result != MOVE_LIMIT and game.game_state not in TERMINAL_STATES:
+        violations.append(f'Game ended in non-terminal state {game.game_state.name}')
+    return violations
+
+
+def play_game(rng: random.Random, light_policy: Callable, dark_policy: Callable, max_moves: int) -> Tuple[str, int, List[str]]:
+    # Returns (result, number of moves, invariant violations)
+    room = GameRoom()
+    room.start_game()
+    game: Game = room.game
+    captured = {GamePieceColor.LIGHT: 0, GamePieceColor.DARK: 0}
+    move_count = 0
+    while move_count < max_moves:
+        moves = list(game.get_legal_moves())
+        if not moves:
+            # Same condition GamesHandler relies on to end the game
+            if not game.check_victory():
+                return game.game_state.name, move_count, [f'No legal moves in {game.game_state.name} but game not over']
+            break
+        policy = light_policy if game.game_state == GameState.LIGHT_TURN else dark_policy
+        from_field, to_field = policy(game, moves, rng)
+        mover_color = game.get_piece_color(from_field)
+        result: MoveResult = game.move_piece(from_field, to_field)
+        if result.move_error != MoveError.NO_ERROR:
+            return game.game_state.name, move_count, \
+                [f'Legal move {from_field}->{to_field} rejected with {result.move_error.name}']
+        move_count += 1
+        if result.captured_piece_field is not None:
+            opponent_color = GamePieceColor.LIGHT if mover_color == GamePieceColor.DARK else GamePieceColor.DARK
+            captured[opponent_color] += 1
+        if game.check_victory():
+            break
+    result_name = game.game_state.name if game.game_state in TERMINAL_STATES else MOVE_LIMIT
+    room.end_game()
+    return result_name, move_count, check_invariants(game, captured, result_name)
+
+
+def run_chunk(seed: int, game_count: int, light_policy: str, dark_policy: str, max_moves: int,
+              position_cache_size: int) -> dict:
+    Game.print_board = False
+    # Workers are reused between chunks, the cache stays warm but stats are per chunk
+    cache = PositionCache()
+    cache.set_max_size(position_cache_size)
+    hits, misses, evictions = cache.hits, cache.misses, cache.evictions
+    # GameRoom picks the light player with the module level random
+    random.seed(seed)
+    rng = random.Random(seed)
+    results = Counter()
+    lengths = Counter()
+    violations = []
+    for _ in range(game_count):
+        result, move_count, game_violations = play_game(
+            rng, POLICIES[light_policy], POLICIES[dark_policy], max_moves)
+        results[result] += 1
+        lengths[move_count] += 1
+        violations.extend(f'seed {seed}: {violation}' for violation in game_violations)
+    cache_stats = Counter(hits=cache.hits - hits, misses=cache.misses - misses, evictions=cache.evictions - evictions)
+    return {'results': results, 'lengths': lengths, 'violations': violations, 'cache_stats': cache_stats}
+
+
+def length_percentile(lengths: Counter, percentile: float) -> int:
+    target = percentile * sum(lengths.values())
+    seen = 0
+    for length in sorted(lengths):
+        seen += lengths[length]
+        if seen >= target:
+            return length
+    return 0
+
+
+def print_report(results: Counter, lengths: Counter, violations: List[str], cache_stats: Counter, elapsed: float) -> None:
+    game_count = sum(results.values())
+    move_count = sum(length * count for length, count in lengths.items())
+    print(f'{game_count} games, {move_count} moves in {elapsed:.2f}s')
+    print(f'{game_count / elapsed:.1f} games/s, {move_count / elapsed:.1f} moves/s')
+    print('Results:')
+    for result, count in results.most_common():
+        print(f'  {result:<12} {count:>10} ({100 * count / game_count:.2f}%)')
+    print('Game length (moves):')
+    print(f'  min {min(lengths)}, mean {move_count / game_count:.1f}, max {max(lengths)}')
+    print('  ' + ', '.join(f'p{int(p * 100)} {length_percentile(lengths, p)}' for p in (0.5, 0.9, 0.99)))
+    lookups = cache_stats['hits'] + cache_stats['misses']
+    print(f"Position cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+          f"({100 * cache_stats['hits'] / lookups if lookups else 0:.1f}% hit rate), {cache_stats['evictions']} evictions")
+    print(f'Invariant violations: {len(violations)}')
+    for violation in violations[:20]:
+        print(f'  {violation}')
+
+
+if __name__ == '__main__':
+    options.parse_command_line()
+    for policy in (options.light_policy, options.dark_policy):
+        if policy not in POLICIES:
+            raise SystemExit(f'Unknown policy {policy}, choose from {", ".join(POLICIES)}')
+    for name in ('games', 'chunk_size'):
+        if options[name] < 1:
+            raise SystemExit(f'--{name} must be at least 1')
+    chunks = [(options.seed + n, min(options.chunk_size, options.games - start))
+              for n, start in enumerate(range(0, options.games, options.chunk_size))]
+    results = Counter()
+    lengths = Counter()
+    violations = []
+    cache_stats = Counter()
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=options.workers) as executor:
+        futures = [executor.submit(run_chunk, seed, game_count, options.light_policy,
+                                   options.dark_policy, options.max_moves, options.position_cache_size)
+                   for seed, game_count in chunks]
+        for future in futures:
+            chunk = future.result()
+            results.update(chunk['results'])
+            lengths.update(chunk['lengths'])
+            violations.extend(chunk['violations'])
+            cache_stats.update(chunk['cache_stats'])
+    print_report(results, lengths, violations, cache_stats, time.perf_counter() - start_time)
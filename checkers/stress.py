@@ -0,0 +1,254 @@
+from checkers.game.game import Game
+from checkers.game.games_handler import GamesHandler
+from checkers.game.player import Player
+from checkers.messages import MessageType
+from collections import Counter
+from typing import Callable, Dict, List
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from tornado.options import options, define
+
+import asyncio
+import logging
+import random
+import threading
+import uuid
+
+
+define('loop_threads', group='stress', default=4, help='Number of IOLoop threads')
+define('players', group='stress', default=1001, help='Number of players joining, half as many join late')
+define('move_rounds', group='stress', default=300, help='Moves played in every room, each sent from a random loop')
+define('seed', group='stress', default=0, help='Seed')
+
+
+class FakeConnection:
+    # Stands in for PlayerHandler, records which thread each message was sent from
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.received: List[tuple] = []
+
+    def send_msg(self, msg_type: MessageType, data: dict = None) -> None:
+        with self.lock:
+            self.received.append((msg_type, threading.get_ident()))
+
+    def count(self, msg_type: MessageType) -> int:
+        with self.lock:
+            return len([msg for msg in self.received if msg[0] == msg_type])
+
+
+class CallbackErrors(logging.Handler):
+    # Tornado logs exceptions raised in loop callbacks instead of passing them on
+    def __init__(self) -> None:
+        super().__init__(logging.ERROR)
+        self.errors: List[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        error = record.exc_info[1] if record.exc_info else None
+        self.errors.append(f'{type(error).__name__}: {error} in a loop callback' if error else record.getMessage())
+
+
+class LoopThreads:
+    def __init__(self, count: int) -> None:
+        self.loops: List[IOLoop] = []
+        self.thread_ids: Dict[IOLoop, int] = {}
+        ready = threading.Barrier(count + 1)
+        for _ in range(count):
+            threading.Thread(target=self.run, args=(ready, ), daemon=True).start()
+        ready.wait()
+
+    def run(self, ready: threading.Barrier) -> None:
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        io_loop = IOLoop.current()
+        self.loops.append(io_loop)
+        self.thread_ids[io_loop] = threading.get_ident()
+        io_loop.add_callback(ready.wait)
+        io_loop.start()
+
+    def sync(self, rounds: int = 3) -> None:
+        # Every round waits for the callbacks queued so far, handovers between loops
+        # need one round per hop
+        for _ in range(rounds):
+            done = threading.Barrier(len(self.loops) + 1)
+            for io_loop in self.loops:
+                io_loop.add_callback(done.wait)
+            done.wait()
+
+    def stop(self) -> None:
+        for io_loop in self.loops:
+            io_loop.add_callback(io_loop.stop)
+
+
+class Players:
+    # Every Player object handed out by GamesHandler. A uuid gets a new one when it
+    # joins again after its room was removed.
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.uuids: List[str] = []
+        self.players: Dict[str, List[Player]] = {}
+        self.connections: Dict[Player, FakeConnection] = {}
+
+    def join(self, uuid_str: str) -> None:
+        # Same calls as PlayerHandler.msg_recv_join_existing
+        player, is_new = GamesHandler().add_player(uuid_str)
+        with self.lock:
+            if is_new:
+                self.players.setdefault(uuid_str, []).append(player)
+            # A concurrent join of the same uuid can get here before the one that created the player
+            connection = self.connections.setdefault(player, FakeConnection())
+        player.set_send_msg_func(connection.send_msg)
+        player.mark_connected()
+        if is_new:
+            GamesHandler().check_and_start_game(player.room)
+        else:
+            GamesHandler().send_state(player)
+
+    def leave(self, uuid_str: str) -> None:
+        player = GamesHandler().get_player(uuid_str)
+        if player is not None:
+            self.close(player)
+
+    def close(self, player: Player) -> None:
+        # Same calls as PlayerHandler.on_close, player may be outdated if its connection
+        # outlived the room
+        player.mark_disconnected()
+        GamesHandler().remove_if_not_in_game(player)
+
+
+def check_registry(players: Players, loop_threads: LoopThreads) -> List[str]:
+    errors = []
+    handler = GamesHandler()
+    registered_rooms = set(room.get_uuid_str() for room in handler.get_rooms())
+    rooms = {}
+    for uuid_str in players.uuids:
+        if not players.players.get(uuid_str):
+            errors.append(f'Player {uuid_str} never joined')
+            continue
+        registered = handler.get_player(uuid_str)
+        for player in players.players[uuid_str]:
+            rooms[player.room.get_uuid_str()] = player.room
+            room_registered = player.room.get_uuid_str() in registered_rooms
+            if room_registered and registered is not player:
+                errors.append(f'Player {uuid_str} lost, its room is still registered')
+            if registered is player and not room_registered:
+                errors.append(f'Player {uuid_str} registered but its room was removed')
+        if registered is not None and registered is not players.players[uuid_str][-1]:
+            errors.append(f'Player {uuid_str} registered as an outdated object')
+    seen_players = Counter()
+    for room_uuid, room in rooms.items():
+        for in_room_id, player in enumerate(room.players):
+            if player is None:
+                continue
+            seen_players[player.get_uuid_str()] += 1
+            if player.room is not room or player.in_room_id != in_room_id:
+                errors.append(f'Player {player.get_uuid_str()} points to a different room')
+            owner_thread = loop_threads.thread_ids[room.io_loop]
+            for msg_type, thread_id in players.connections[player].received:
+                if thread_id != owner_thread:
+                    errors.append(f'{msg_type.name} for room {room_uuid} sent outside its loop')
+        if room.players[0] is not None and room.players[0] is room.players[1]:
+            errors.append(f'Room {room_uuid} holds the same player twice')
+        starts = [players.connections[player].count(MessageType.START_GAME)
+                  for player in room.players if player is not None]
+        expected = 1 if room.is_full() else 0
+        if any(start != expected for start in starts):
+            errors.append(f'Room {room_uuid} players got {starts} START_GAME, expected {expected}')
+        if room_uuid in registered_rooms:
+            if room.is_full() and room in handler.waiting_rooms:
+                errors.append(f'Full room {room_uuid} is still waiting for players')
+            if not room.is_full() and room not in handler.waiting_rooms:
+                errors.append(f'Room {room_uuid} lost from waiting rooms')
+        elif room.is_full() and not room.finished:
+            errors.append(f'Room {room_uuid} removed with its game {"running" if room.in_game else "starting"}')
+    for uuid_str, count in seen_players.items():
+        if count > len(players.players[uuid_str]):
+            errors.append(f'Player {uuid_str} matched into {count} rooms')
+    if len(registered_rooms) != len([room_uuid for room_uuid in rooms if room_uuid in registered_rooms]):
+        errors.append('Registered room without any known player')
+    registered_players = len([uuid_str for uuid_str in players.uuids if handler.get_player(uuid_str)])
+    if handler.count_players() != registered_players:
+        errors.append(f'{handler.count_players()} players registered, {registered_players} expected')
+    return errors
+
+
+def play_moves(loop_threads: LoopThreads, rng: random.Random) -> int:
+    # Sends one legal move for every running game, each from a random loop
+    move_count = 0
+    for room in GamesHandler().get_rooms():
+        if not room.in_game:
+            continue
+        game: Game = room.game
+        moves = list(game.get_legal_moves())
+        if not moves:
+            continue
+        from_field, to_field = rng.choice(moves)
+        player = [player for player in room.players if player.piece_color == game.get_piece_color(from_field)][0]
+        rng.choice(loop_threads.loops).add_callback(GamesHandler().move_piece, player, from_field, to_field)
+        move_count += 1
+    return move_count
+
+
+def join_and_leave(players: Players, schedule: Callable, rng: random.Random, count: int,
+                   leave_chance: float) -> None:
+    # New players join from random loops (some twice at once, as a quick reconnect would)
+    # while others leave from random loops, so departures race with matching
+    for _ in range(count):
+        uuid_str = uuid.uuid4().hex
+        players.uuids.append(uuid_str)
+        schedule(players.join, uuid_str)
+        if rng.random() < 0.3:
+            schedule(players.join, uuid_str)
+        if rng.random() < leave_chance:
+            # Mostly the previous joiner, who is likely still waiting for an opponent
+            candidates = players.uuids
+            leaving = candidates[-2] if len(candidates) > 1 and rng.random() < 0.7 else rng.choice(candidates)
+            schedule(players.leave, leaving)
+
+
+if __name__ == '__main__':
+    options.parse_command_line()
+    rng = random.Random(options.seed)
+    Game.print_board = False
+    callback_errors = CallbackErrors()
+    app_log.addHandler(callback_errors)
+    loop_threads = LoopThreads(options.loop_threads)
+    players = Players()
+
+    def schedule(func: Callable, *args) -> None:
+        rng.choice(loop_threads.loops).add_callback(func, *args)
+
+    join_and_leave(players, schedule, rng, options.players, 0.3)
+    loop_threads.sync()
+
+    move_count = 0
+    for _ in range(options.move_rounds):
+        move_count += play_moves(loop_threads, rng)
+        loop_threads.sync()
+
+    # Late joiners arrive while players of waiting, running and finished rooms leave
+    join_and_leave(players, schedule, rng, options.players // 2 + 1, 0.5)
+    leavers = [uuid_str for uuid_str in players.uuids if rng.random() < 0.3]
+    for uuid_str in leavers:
+        schedule(players.leave, uuid_str)
+    loop_threads.sync()
+    # Some come back, those whose room was removed get a new Player, then the
+    # connections of their old Players close late
+    for uuid_str in leavers:
+        if rng.random() < 0.5:
+            schedule(players.join, uuid_str)
+    loop_threads.sync()
+    for uuid_str in players.uuids:
+        for player in players.players[uuid_str][:-1]:
+            schedule(players.close, player)
+    loop_threads.sync()
+
+    errors = callback_errors.errors + check_registry(players, loop_threads)
+    rooms = set(player.room for player in players.connections)
+    print(f'{options.loop_threads} loops, {len(players.uuids)} players, {len(rooms)} rooms '
+          f'({GamesHandler().count_rooms()} left, {len([room for room in rooms if room.finished])} games finished), '
+          f'{move_count} moves')
+    print(f'Errors: {len(errors)}')
+    for error in errors[:20]:
+        print(f'  {error}')
+    loop_threads.stop()
+    if errors:
+        raise SystemExit(1)